@@ -1,8 +1,9 @@
 # %%
-import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import hopsworks
+import numpy as np
 import pandas as pd
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import util
@@ -19,67 +20,65 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # %%
-def load_locations(filepath: str = "locations.json") -> dict:
-    """Load location data from JSON file."""
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-
-locations = load_locations()
+locations = util.load_locations()
 
 # %%
-def process_air_quality(df: pd.DataFrame, location: dict) -> None:
+def process_air_quality(df: pd.DataFrame, location: dict) -> pd.DataFrame:
     """
-    Process air quality dataframe in place.
+    Process a raw air quality dataframe.
 
-    Transforms the dataframe to have columns: [id, date, pm25]
+    Returns a new dataframe with columns: [id, date, pm25]
     """
-    df.rename(columns={"median": "pm25"}, inplace=True)
-    df["date"] = df["date"].dt.date
-    df["pm25"] = df["pm25"].astype("float32")
-    df.drop(df.columns.difference(["date", "pm25"]), axis=1, inplace=True)
-    df.dropna(inplace=True)
-    df["id"] = location["id"]
+    out = pd.DataFrame({
+        "id": location["id"],
+        "date": df["date"].to_numpy(),
+        "pm25": df["median"].to_numpy(dtype="float32", na_value=np.nan),
+    })
+    return out.dropna()
 
 # %%
 def add_lagged_features(df: pd.DataFrame) -> pd.DataFrame:
     """Add lagged PM2.5 features for 1, 2, and 3 days."""
     df = df.sort_values(['id', 'date']).copy()
-    
-    # Create lagged features for each location
-    for location_id in df['id'].unique():
-        mask = df['id'] == location_id
-        location_data = df[mask].copy()
-        
-        # Create lagged features
-        df.loc[mask, 'lagged_1'] = location_data['pm25'].shift(1)
-        df.loc[mask, 'lagged_2'] = location_data['pm25'].shift(2)
-        df.loc[mask, 'lagged_3'] = location_data['pm25'].shift(3)
-    
-    # Convert to float32
+
+    # Shift pm25 within each location in a single vectorized pass per lag,
+    # filling with a float32 NaN so the lags keep pm25's float32 dtype
+    grouped = df.groupby('id', sort=False, observed=True)['pm25']
     for lag in [1, 2, 3]:
-        df[f'lagged_{lag}'] = df[f'lagged_{lag}'].astype('float32')
-    
+        df[f'lagged_{lag}'] = grouped.shift(lag, fill_value=np.float32(np.nan))
+
     return df
 
 # %%
-def load_air_quality_data(locations: dict) -> pd.DataFrame:
-    """Load and process air quality data for all locations."""
-    dfs = []
+def read_and_process(location_id: str, location: dict) -> pd.DataFrame:
+    """Read the CSV for a single location and process it."""
+    file_path = Path(f"data/{location_id}.csv")
+    if not file_path.is_file():
+        raise FileNotFoundError(f"File {file_path} not found")
+
+    print(f"Processing {location_id}")
+    # Only parse the columns process_air_quality keeps, straight into their final dtypes
+    df = pd.read_csv(
+        file_path,
+        comment="#",
+        skipinitialspace=True,
+        usecols=["date", "median"],
+        dtype={"median": "float32"},
+        parse_dates=["date"],
+    )
+    return process_air_quality(df, location)
 
-    for location_id in locations:
-        file_path = Path(f"data/{location_id}.csv")
-        if not file_path.is_file():
-            raise FileNotFoundError(f"File {file_path} not found")
 
-        print(f"Processing {location_id}")
-        df = pd.read_csv(
-            file_path, comment="#", skipinitialspace=True, parse_dates=["date"]
-        )
-        process_air_quality(df, locations[location_id])
-        dfs.append(df)
+def load_air_quality_data(locations: dict) -> pd.DataFrame:
+    """Load and process air quality data for all locations."""
+    # pandas' C parser releases the GIL, so the CSVs are parsed in parallel
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(locations)))) as executor:
+        dfs = list(executor.map(read_and_process, locations.keys(), locations.values()))
 
     combined_df = pd.concat(dfs, ignore_index=True)
+
+    # Group on integer category codes instead of hashing the id strings
+    combined_df['id'] = combined_df['id'].astype('category')
     
     # Add lagged features
     print("Adding lagged features...")
@@ -89,6 +88,10 @@ def load_air_quality_data(locations: dict) -> pd.DataFrame:
     print(f"Rows before dropping NaNs: {len(combined_df)}")
     combined_df = combined_df.dropna(subset=['lagged_1', 'lagged_2', 'lagged_3'])
     print(f"Rows after dropping NaNs: {len(combined_df)}")
+
+    # Keep the feature group schema unchanged (string id, date objects)
+    combined_df['id'] = combined_df['id'].astype(str)
+    combined_df['date'] = combined_df['date'].dt.date
     
     return combined_df
 
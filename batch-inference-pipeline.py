@@ -1,17 +1,24 @@
 # %%
-import json
 import os
 from datetime import date, timedelta
 import hopsworks
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from xgboost import XGBRegressor
+import util
 
 # %%
 class Settings(BaseSettings):
     """Application settings loaded from .env file."""
     hopsworks_api_key: str
+    # Version 3 of air_quality carries the lagged features from the backfill
+    air_quality_fg_version: int = 3
+    # Set to a directory to cache feature group reads between runs (off by default)
+    fg_cache_dir: str | None = None
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -21,13 +28,7 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # %%
-def load_locations(filepath: str = "locations.json") -> dict:
-    """Load location data from JSON file."""
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-
-locations = load_locations()
+locations = util.load_locations()
 locations
 
 # %%
@@ -58,7 +59,7 @@ print("✓ Model loaded successfully")
 today_str = date.today().strftime("%Y-%m-%d")
 weather_fg = fs.get_feature_group(name="weather", version=2)
 
-batch_data = weather_fg.filter(weather_fg.date >= today_str).read()
+batch_data = util.read_cached(weather_fg, today_str, cache_dir=settings.fg_cache_dir)
 print(f"✓ Retrieved {len(batch_data)} weather forecast records")
 batch_data.head()
 
@@ -67,17 +68,9 @@ batch_data.head()
 lookback_days = 3 
 lookback_date = (date.today() - timedelta(days=lookback_days)).strftime("%Y-%m-%d")
 
-# Try version 3 first (with lagged features from backfill)
-try:
-    air_quality_fg = fs.get_feature_group(name="air_quality", version=3)
-    historical_aq = air_quality_fg.filter(air_quality_fg.date >= lookback_date).read()
-    print(f"✓ Retrieved {len(historical_aq)} historical records from version 3")
-except Exception as e:
-    print(f"⚠ Could not load from version 3: {e}")
-    print("Falling back to version 2...")
-    air_quality_fg = fs.get_feature_group(name="air_quality", version=2)
-    historical_aq = air_quality_fg.filter(air_quality_fg.date >= lookback_date).read()
-    print(f"✓ Retrieved {len(historical_aq)} historical records from version 2")
+air_quality_fg = fs.get_feature_group(name="air_quality", version=settings.air_quality_fg_version)
+historical_aq = util.read_cached(air_quality_fg, lookback_date, cache_dir=settings.fg_cache_dir)
+print(f"✓ Retrieved {len(historical_aq)} historical records from version {air_quality_fg.version}")
 
 # Sort by date for easy lookup
 historical_aq = historical_aq.sort_values(['id', 'date'])
@@ -85,66 +78,89 @@ print(f"Date range: {historical_aq['date'].min()} to {historical_aq['date'].max(
 historical_aq.head()
 
 # %%
+# Feature order must match the order used during training
+feature_columns = [
+    "lagged_1",
+    "lagged_2",
+    "lagged_3",
+    "weather_temperature_2m_mean",
+    "weather_precipitation_sum",
+    "weather_wind_speed_10m_max",
+    "weather_wind_direction_10m_dominant",
+]
+
+# Split weather and history by location once instead of filtering per location
+weather_by_id = {k: v for k, v in batch_data.groupby("id", sort=False)}
+# historical_aq is sorted by (id, date): keep the 3 most recent rows per location,
+# reversed so the most recent comes first
+recent_aq = historical_aq.groupby("id", sort=False).tail(3)
+hist_by_id = {k: v.iloc[::-1] for k, v in recent_aq.groupby("id", sort=False)}
+
 # Prepare predictions with lagged features from historical data (simplified approach)
-predictions_list = []
+location_inputs = []
 
 for location_id, location in locations.items():
-    location_weather = batch_data[batch_data["id"] == location_id].copy()
+    location_weather = weather_by_id.get(location_id)
     
-    if location_weather.empty:
+    if location_weather is None:
         print(f"⚠ No weather forecast for {location['city']}")
         continue
     
     # Get the most recent 3 days of historical data for this location
-    location_history = historical_aq[historical_aq['id'] == location_id].sort_values('date', ascending=False)
+    location_history = hist_by_id.get(location_id)
     
-    if len(location_history) < 3:
+    if location_history is None or len(location_history) < 3:
         print(f"⚠ Not enough historical data for {location['city']} - need at least 3 days")
         continue
     
     # Use the 3 most recent historical values as lagged features for ALL predictions
-    lagged_1 = float(location_history.iloc[0]['pm25'])  # Most recent
-    lagged_2 = float(location_history.iloc[1]['pm25'])  # 2 days ago
-    lagged_3 = float(location_history.iloc[2]['pm25'])  # 3 days ago
-    
-    print(f"\nProcessing forecasts for {location['city']}...")
-    print(f"  Using lagged values: {lagged_1:.1f}, {lagged_2:.1f}, {lagged_3:.1f}")
+    pm25_history = location_history['pm25'].to_numpy(dtype=np.float32)
+    lagged_1 = pm25_history[0]  # Most recent
+    lagged_2 = pm25_history[1]  # 2 days ago
+    lagged_3 = pm25_history[2]  # 3 days ago
     
-    # For each forecast day, use the same lagged features
-    for _, weather_row in location_weather.iterrows():
-        forecast_date = pd.to_datetime(weather_row["date"])
-        
-        # Prepare feature vector in the SAME ORDER as training
-        feature_row = {
-            "lagged_1": lagged_1,
-            "lagged_2": lagged_2,
-            "lagged_3": lagged_3,
-            "weather_temperature_2m_mean": weather_row["temperature_2m_mean"],
-            "weather_precipitation_sum": weather_row["precipitation_sum"],
-            "weather_wind_speed_10m_max": weather_row["wind_speed_10m_max"],
-            "weather_wind_direction_10m_dominant": weather_row["wind_direction_10m_dominant"]
-        }
-        
-        X_pred = pd.DataFrame([feature_row])
-        
-        # Make prediction
-        prediction = retrieved_xgboost_model.predict(X_pred)[0]
-        prediction = max(0, prediction)  # Clip negative values
-        
-        predictions_list.append({
-            "id": location_id,
-            "date": weather_row["date"],
-            "predicted_pm25": prediction,
-            "forecast_date": date.today()
-        })
-        
-        print(f"  ✓ {forecast_date.date()}: {prediction:.2f} μg/m³")
+    print(f"Using lagged values for {location['city']}: {lagged_1:.1f}, {lagged_2:.1f}, {lagged_3:.1f}")
+    location_inputs.append((location_id, location_weather, (lagged_1, lagged_2, lagged_3)))
 
 # %%
-forecast_data = pd.DataFrame(predictions_list)
-
-# Convert predicted_pm25 to float32 to match feature group schema
-forecast_data["predicted_pm25"] = forecast_data["predicted_pm25"].astype("float32")
+# Fill one preallocated feature matrix (one row per location and forecast day)
+weather_columns = [column.removeprefix("weather_") for column in feature_columns[3:]]
+n_rows = sum(len(location_weather) for _, location_weather, _ in location_inputs)
+
+ids = np.empty(n_rows, dtype=object)
+features = np.empty((n_rows, len(feature_columns)), dtype=np.float32)
+date_chunks = []
+
+offset = 0
+for location_id, location_weather, lags in location_inputs:
+    rows = slice(offset, offset + len(location_weather))
+    ids[rows] = location_id
+    features[rows, :3] = lags
+    features[rows, 3:] = location_weather[weather_columns].to_numpy(dtype=np.float32)
+    date_chunks.append(location_weather["date"].to_numpy())
+    offset = rows.stop
+
+# Predict every location and forecast day in a single batched call
+if n_rows:
+    predictions = retrieved_xgboost_model.predict(pd.DataFrame(features, columns=feature_columns))
+    np.clip(predictions, 0, None, out=predictions)  # Clip negative values
+    dates = np.concatenate(date_chunks)
+else:
+    predictions = np.empty(0, dtype=np.float32)
+    dates = np.empty(0, dtype="datetime64[ns]")
+
+forecast_data = pd.DataFrame({
+    "id": ids,
+    "date": dates,
+    # Convert predicted_pm25 to float32 to match feature group schema
+    "predicted_pm25": predictions.astype(np.float32, copy=False),
+    "forecast_date": np.full(n_rows, date.today(), dtype=object),
+})
+
+# Convert the dates once for printing rather than per row
+forecast_days = pd.to_datetime(forecast_data["date"], cache=True).dt.date
+for location_id, forecast_day, prediction in zip(ids, forecast_days, predictions):
+    print(f"  ✓ {locations[location_id]['city']} {forecast_day}: {prediction:.2f} μg/m³")
 
 print(f"\n✓ Generated {len(forecast_data)} total predictions")
 forecast_data.head()
@@ -170,42 +186,47 @@ else:
 images_dir = "air_quality_model/images/forecasts"
 os.makedirs(images_dir, exist_ok=True)
 
+# Reuse a single figure for every location instead of creating one per plot
+fig, ax = plt.subplots(figsize=(12, 6))
+forecast_by_id = {k: v for k, v in forecast_data.groupby("id", sort=False)}
+
 for location_id, location in locations.items():
-    location_forecast = forecast_data[forecast_data["id"] == location_id].copy()
+    location_forecast = forecast_by_id.get(location_id)
     
-    if location_forecast.empty:
+    if location_forecast is None:
         print(f"⚠ No forecast data for {location['city']}")
         continue
     
     location_forecast = location_forecast.sort_values("date")
     
-    plt.figure(figsize=(12, 6))
-    plt.plot(location_forecast["date"], location_forecast["predicted_pm25"], 
-             marker="o", linewidth=2, markersize=8, label="Predicted PM2.5 (with lagged features)")
-    plt.xlabel("Date")
-    plt.ylabel("Predicted PM2.5 (μg/m³)")
-    plt.title(f"Air Quality Forecast - {location['city']}, {location['country']}")
-    plt.axhline(y=25, color='orange', linestyle='--', label='Moderate', alpha=0.7)
-    plt.axhline(y=50, color='red', linestyle='--', label='Unhealthy', alpha=0.7)
-    plt.legend()
-    plt.xticks(rotation=45)
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
+    ax.cla()
+    ax.plot(location_forecast["date"], location_forecast["predicted_pm25"], 
+            marker="o", linewidth=2, markersize=8, label="Predicted PM2.5 (with lagged features)")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Predicted PM2.5 (μg/m³)")
+    ax.set_title(f"Air Quality Forecast - {location['city']}, {location['country']}")
+    ax.axhline(y=25, color='orange', linestyle='--', label='Moderate', alpha=0.7)
+    ax.axhline(y=50, color='red', linestyle='--', label='Unhealthy', alpha=0.7)
+    ax.legend()
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
     
     plot_path = os.path.join(images_dir, f"pm25_forecast_{location['city']}.png")
-    plt.savefig(plot_path, dpi=100)
-    plt.close()
+    fig.savefig(plot_path, dpi=100)
     
     print(f"✓ Saved forecast plot for {location['city']}")
 
+plt.close(fig)
+
 # %%
 print(f"""
 Batch Inference Summary (with Lagged Features):
 ----------------------------------------------
 Forecast date: {date.today()}
 Locations: {len(locations)}
-Total predictions: {len(predictions_list)}
-Predictions per location: ~{len(predictions_list) // len(locations) if locations else 0}
+Total predictions: {len(forecast_data)}
+Predictions per location: ~{len(forecast_data) // len(locations) if locations else 0}
 Saved to feature group: air_quality_forecasts v1
 
 Note: Predictions use the 3 most recent historical PM2.5 values as lagged features
@@ -1,5 +1,5 @@
 # %%
-import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 import hopsworks
 import pandas as pd
@@ -21,13 +21,7 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # %%
-def load_locations(filepath: str = "locations.json") -> dict:
-    """Load location data from JSON file."""
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-
-locations = load_locations()
+locations = util.load_locations()
 locations
 
 # %%
@@ -39,45 +33,47 @@ def add_lagged_features(air_quality_df: pd.DataFrame, air_quality_fg) -> pd.Data
     last_4_days = (today - timedelta(days=4)).strftime("%Y-%m-%d")
     historical_data = air_quality_fg.filter(air_quality_fg.date >= last_4_days).read()
     
-    # For each row in today's data, find lagged values
-    for idx, row in air_quality_df.iterrows():
-        location_id = row['id']
-        current_date = row['date']
-        
-        # Get historical data for this location
-        location_history = historical_data[historical_data['id'] == location_id].sort_values('date')
-        
-        # Calculate lagged features
-        for lag in [1, 2, 3]:
-            lag_date = pd.to_datetime(current_date) - timedelta(days=lag)
-            lag_data = location_history[pd.to_datetime(location_history['date']) == lag_date]
-            
-            if not lag_data.empty:
-                air_quality_df.loc[idx, f'lagged_{lag}'] = lag_data.iloc[0]['pm25']
-            else:
-                air_quality_df.loc[idx, f'lagged_{lag}'] = None
+    historical_data = historical_data[['id', 'date', 'pm25']].copy()
+    historical_data['date'] = pd.to_datetime(historical_data['date'])
+    historical_data = historical_data.drop_duplicates(subset=['id', 'date'])
+    
+    # Join today's rows against the history shifted forward by each lag
+    air_quality_df = air_quality_df.assign(lag_key=pd.to_datetime(air_quality_df['date']))
+    for lag in [1, 2, 3]:
+        hist_lag = historical_data.rename(columns={'date': 'lag_key', 'pm25': f'lagged_{lag}'})
+        hist_lag['lag_key'] = hist_lag['lag_key'] + pd.Timedelta(days=lag)
+        air_quality_df = air_quality_df.merge(hist_lag, on=['id', 'lag_key'], how='left')
+    air_quality_df = air_quality_df.drop(columns='lag_key')
     
     # Convert lagged columns to float32
     for lag in [1, 2, 3]:
-        if f'lagged_{lag}' in air_quality_df.columns:
-            air_quality_df[f'lagged_{lag}'] = air_quality_df[f'lagged_{lag}'].astype('float32')
+        air_quality_df[f'lagged_{lag}'] = air_quality_df[f'lagged_{lag}'].astype('float32')
     
     return air_quality_df
 
 
 # %%
-air_quality_df = pd.DataFrame()
+frames = []
 today = date.today()
 
-for location_id, location in locations.items():
+# Fetch all locations concurrently; each request is dominated by network latency
+with ThreadPoolExecutor(max_workers=max(1, min(32, len(locations)))) as executor:
+    futures = {
+        location_id: executor.submit(util.get_pm25, location_id, location, today, settings.aqicn_api_key)
+        for location_id, location in locations.items()
+    }
+
+for location_id, future in futures.items():
+    location = locations[location_id]
     try:
-        aq_data = util.get_pm25(location_id, location, today, settings.aqicn_api_key)
-        air_quality_df = pd.concat([air_quality_df, aq_data], ignore_index=True)
+        aq_data = future.result()
+        frames.append(aq_data)
         print(f"✓ Fetched air quality for {location['city']}")
     except Exception as e:
         print(f"✗ Error for {location_id}: {e}")
         continue
 
+air_quality_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 air_quality_df.info()
 
 # %%
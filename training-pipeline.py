@@ -1,5 +1,4 @@
 # %%
-import json
 import os
 from datetime import datetime, timedelta
 
@@ -9,6 +8,7 @@ import pandas as pd
 from pydantic_settings import BaseSettings
 from sklearn.metrics import mean_squared_error, r2_score
 from xgboost import XGBRegressor, plot_importance
+import util
 
 # %%
 class Settings(BaseSettings):
@@ -23,13 +23,7 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # %%
-def load_locations(filepath: str = "locations.json") -> dict:
-    """Load location data from JSON file."""
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-
-locations = load_locations()
+locations = util.load_locations()
 locations
 
 # %%
@@ -1,5 +1,12 @@
+import functools
+import json
+import os
+import time
+from pathlib import Path
+
 import openmeteo_requests
 import pandas as pd
+import pyarrow as pa
 import requests_cache
 import requests
 from datetime import date
@@ -13,6 +20,59 @@ OPENMETEO_DAILY_VARIABLES = [
 ]
 
 
+@functools.lru_cache(maxsize=1)
+def load_locations(filepath: str = "locations.json") -> dict:
+    """Load location data from JSON file, parsing it only once per process."""
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def read_cached(
+    fg, date_from: str, cache_dir: str | None = None, max_age: int = 900
+) -> pd.DataFrame:
+    """
+    Read rows of a feature group with date >= date_from, optionally caching them locally.
+
+    Caching is opt-in: with cache_dir unset the feature group is always read.
+    Otherwise the result is stored as an Arrow IPC file keyed by feature group
+    name, version and start date, and reused for at most max_age seconds so
+    rows inserted later (e.g. by the daily pipeline) are picked up. A missing,
+    expired or unreadable cache file falls back to a fresh read.
+    """
+    if cache_dir is None:
+        return fg.filter(fg.date >= date_from).read()
+
+    path = Path(cache_dir) / f"{fg.name}_v{fg.version}_{date_from}.arrow"
+
+    try:
+        if time.time() - path.stat().st_mtime <= max_age:
+            with pa.OSFile(str(path), "rb") as source:
+                return pa.ipc.open_file(source).read_all().to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+    df = fg.filter(fg.date >= date_from).read()
+
+    # Write to a temporary file first so an interrupted run never leaves a truncated cache
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".arrow.tmp")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_file(str(tmp_path), table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    return df
+
+
+def _coordinates(places: dict[str, dict]) -> tuple[list[str], list[str]]:
+    """Split places into latitude and longitude lists in a single pass."""
+    latitudes, longitudes = [], []
+    for place in places.values():
+        latitudes.append(place["latitude"])
+        longitudes.append(place["longitude"])
+    return latitudes, longitudes
+
+
 def _create_openmeteo_client(cache_expiry: int = -1) -> openmeteo_requests.Client:
     """Create an Open-Meteo API client with caching and retry logic."""
     cache_session = requests_cache.CachedSession(".cache", expire_after=cache_expiry)
@@ -24,26 +84,25 @@ def _process_weather_responses(
     responses: list, places: dict[str, dict], variables: list[str]
 ) -> pd.DataFrame:
     """Process weather API responses into a DataFrame."""
-    dataframes = []
+    # One Arrow chunk per response and column, converted to pandas in a single step
+    chunks = {column: [] for column in ["id", "date", *variables]}
 
     for response, place_id in zip(responses, places.keys()):
         daily = response.Daily()
-        data = {
-            "id": place_id,
-            "date": pd.date_range(
-                start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-                end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-                freq=pd.Timedelta(seconds=daily.Interval()),
-                inclusive="left",
-            ),
-        }
-
+        dates = pd.date_range(
+            start=pd.to_datetime(daily.Time(), unit="s", utc=True),
+            end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
+            freq=pd.Timedelta(seconds=daily.Interval()),
+            inclusive="left",
+        )
+
+        chunks["id"].append(pa.array([place_id] * len(dates), type=pa.string()))
+        chunks["date"].append(pa.array(dates))
         for idx, variable in enumerate(variables):
-                data[variable] = daily.Variables(idx).ValuesAsNumpy()
-
-        dataframes.append(pd.DataFrame(data))
+            chunks[variable].append(pa.array(daily.Variables(idx).ValuesAsNumpy()))
 
-    result = pd.concat(dataframes, ignore_index=True)
+    table = pa.table({column: pa.chunked_array(arrays) for column, arrays in chunks.items()})
+    result = table.to_pandas(split_blocks=True, self_destruct=True)
     result.dropna(inplace=True)
     result["date"] = result["date"].dt.date
     return result
@@ -52,10 +111,11 @@ def _process_weather_responses(
 def get_forecast(forecast_days: int, places: dict[str, dict]) -> pd.DataFrame:
     """Fetch weather forecast for multiple locations."""
     client = _create_openmeteo_client(cache_expiry=3600)
+    latitudes, longitudes = _coordinates(places)
 
     params = {
-        "latitude": [place["latitude"] for place in places.values()],
-        "longitude": [place["longitude"] for place in places.values()],
+        "latitude": latitudes,
+        "longitude": longitudes,
         "forecast_days": forecast_days,
         "daily": OPENMETEO_DAILY_VARIABLES,
     }
@@ -68,14 +128,14 @@ def get_forecast(forecast_days: int, places: dict[str, dict]) -> pd.DataFrame:
 
 def get_historical(aq_df: pd.DataFrame, places: dict[str, dict]) -> pd.DataFrame:
     """Fetch historical weather data for date ranges present in air quality DataFrame."""
-    start_dates = [
-        aq_df[aq_df["id"] == place["id"]]["date"].min().strftime("%Y-%m-%d")
-        for place in places.values()
-    ]
-    end_dates = [
-        aq_df[aq_df["id"] == place["id"]]["date"].max().strftime("%Y-%m-%d")
-        for place in places.values()
-    ]
+    # One pass over the frame for both bounds, ordered like places
+    date_ranges = (
+        aq_df.groupby("id", sort=False, observed=True)["date"]
+        .agg(["min", "max"])
+        .reindex([place["id"] for place in places.values()])
+    )
+    start_dates = [d.strftime("%Y-%m-%d") for d in date_ranges["min"]]
+    end_dates = [d.strftime("%Y-%m-%d") for d in date_ranges["max"]]
 
     return get_historical_in_daterange(start_dates, end_dates, places)
 
@@ -85,10 +145,11 @@ def get_historical_in_daterange(
 ) -> pd.DataFrame:
     """Fetch historical weather data for specified date ranges."""
     client = _create_openmeteo_client(cache_expiry=-1)
+    latitudes, longitudes = _coordinates(places)
 
     params = {
-        "latitude": [place["latitude"] for place in places.values()],
-        "longitude": [place["longitude"] for place in places.values()],
+        "latitude": latitudes,
+        "longitude": longitudes,
         "start_date": starts,
         "end_date": ends,
         "daily": OPENMETEO_DAILY_VARIABLES,